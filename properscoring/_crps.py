@@ -2,7 +2,7 @@ import numpy as np
 
 from scipy import special, integrate, stats
 
-from ._utils import move_axis_to_end, argsort_indices, suppress_warnings
+from ._utils import move_axis_to_end, argsort_indices
 
 
 # The normalization constant for the univariate standard Gaussian pdf
@@ -184,7 +184,8 @@ def crps_quadrature(x, cdf_or_dist, xmin=None, xmax=None, tol=1e-6):
     return _crps_cdf(x, cdf_or_dist, xmin, xmax, tol)
 
 
-def _crps_ensemble_vectorized(observations, forecasts, weights=1):
+def _crps_ensemble_vectorized(observations, forecasts, weights=1,
+                              issorted=False):
     """
     An alternative but simpler implementation of CRPS for testing purposes
 
@@ -196,8 +197,10 @@ def _crps_ensemble_vectorized(observations, forecasts, weights=1):
     where X and X' denote independent random variables drawn from the forecast
     distribution F, and E_F denotes the expectation value under F.
 
-    Hence it has runtime O(n^2) instead of O(n log(n)) where n is the number of
-    ensemble members.
+    The expectation E_F|X - X'| is evaluated from the order statistics of the
+    sorted ensemble, so this has runtime O(n log(n)) and memory O(n) where n
+    is the number of ensemble members. Pass issorted=True to skip sorting if
+    forecasts (and weights) are already sorted along the last axis.
 
     Reference
     ---------
@@ -209,26 +212,34 @@ def _crps_ensemble_vectorized(observations, forecasts, weights=1):
     observations = np.asarray(observations)
     forecasts = np.asarray(forecasts)
     weights = np.asarray(weights)
-    if weights.ndim > 0:
-        weights = np.where(~np.isnan(forecasts), weights, np.nan)
-        weights = weights / np.nanmean(weights, axis=-1, keepdims=True)
 
     if observations.ndim == forecasts.ndim - 1:
         # sum over the last axis
         assert observations.shape == forecasts.shape[:-1]
         observations = observations[..., np.newaxis]
-        with suppress_warnings('Mean of empty slice'):
-            score = np.nanmean(weights * abs(forecasts - observations), -1)
-        # insert new axes along last and second to last forecast dimensions so
-        # forecasts_diff expands with the array broadcasting
-        forecasts_diff = (np.expand_dims(forecasts, -1) -
-                          np.expand_dims(forecasts, -2))
-        weights_matrix = (np.expand_dims(weights, -1) *
-                          np.expand_dims(weights, -2))
-        with suppress_warnings('Mean of empty slice'):
-            score += -0.5 * np.nanmean(weights_matrix * abs(forecasts_diff),
-                                       axis=(-2, -1))
-        return score
+        # NumPy sorts NaN to the end, so missing members are always trailing
+        weights = weights * np.ones_like(forecasts)
+        if not issorted:
+            idx = argsort_indices(forecasts, axis=-1)
+            forecasts = forecasts[idx]
+            weights = weights[idx]
+        valid = ~np.isnan(forecasts)
+        # normalize weights into probabilities over the non-missing members
+        weights = np.where(valid, weights, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            probs = weights / np.sum(weights, axis=-1, keepdims=True)
+        # both terms are invariant to a common shift, so work with deviations
+        # from the observation to avoid cancellation for large offsets
+        deviations = np.where(valid, forecasts - observations, 0)
+        score = np.sum(probs * abs(deviations), axis=-1)
+        # for sorted members x_i with probabilities p_i summing to one:
+        #   E_F|X - X'| = 2 * sum_i p_i * x_i * (2 * P_i + p_i - 1)
+        # where P_i = sum_{j < i} p_j
+        below = np.cumsum(probs, axis=-1) - probs
+        score += -np.sum(probs * deviations * (2 * below + probs - 1),
+                         axis=-1)
+        # ensembles without any valid members (including empty ones) are NaN
+        return np.where(valid.any(axis=-1), score, np.nan)
     elif observations.ndim == forecasts.ndim:
         # there is no 'realization' axis to sum over (this is a deterministic
         # forecast)
@@ -268,8 +279,9 @@ def crps_ensemble(observations, forecasts, weights=None, issorted=False,
     O(N * E * log(E)) and space O(N * E) where N is the number of observations
     and E is the size of the forecast ensemble.
 
-    The non-Numba accelerated version much slower for large ensembles: it
-    requires both time and space O(N * E ** 2).
+    The non-Numba accelerated version has the same asymptotic complexity, but
+    is slower in practice because it makes several vectorized passes over the
+    sorted ensemble.
 
     Parameters
     ----------
@@ -343,4 +355,8 @@ def crps_ensemble(observations, forecasts, weights=None, issorted=False,
     if weights is None:
         weights = np.ones_like(forecasts)
 
+    if _crps_ensemble_core is _crps_ensemble_vectorized:
+        # forecasts and weights have been sorted above, so don't sort again
+        return _crps_ensemble_vectorized(observations, forecasts, weights,
+                                         issorted=True)
     return _crps_ensemble_core(observations, forecasts, weights)
@@ -1,24 +1,85 @@
-import functools
 import unittest
 import warnings
 
 import numpy as np
+import pytest
 from scipy import stats, special
 from numpy.testing import assert_allclose
 
 from properscoring import crps_ensemble, crps_quadrature, crps_gaussian
 from properscoring._crps import (_crps_ensemble_vectorized,
                                  _crps_ensemble_core)
+from properscoring._utils import argsort_indices
+
+
+TOY_EXAMPLES = [
+    (0, 0, 0.0),
+    (0, 1, 1.0),
+    (-1, 0, 1.0),
+    (0, [-1], 1.0),
+    (0, [0], 0.0),
+    (0, [1], 1.0),
+    (0, [0, 0], 0.0),
+    (0, [0, 1], 0.25),
+    (0, [1, 0], 0.25),
+    (0, [1, 1], 1.0),
+    (2, [0, 1], 1.25),
+    (0, [-1, 1], 0.5),
+    (0, [0, 0, 1], 1.0 / 9),
+    (1, [0, 0, 1], 4.0 / 9),
+    (0, [-1, 0, 0, 1], 1.0 / 8),
+]
+
+WEIGHT_EXAMPLES = [
+    # Simplest test.
+    (1., [0, 2], [0.5, 0.5], 0.5),
+    # Out-of-order analogues.
+    (1., [2, 0], [0.5, 0.5], 0.5),
+    # Test non-equal weighting.
+    (1., [0, 2], [0.8, 0.2], 0.64 + 0.04),
+    # Test non-equal weighting + non-equal distances.
+    (1.5, [0, 2], [0.8, 0.2], 0.64 * 1.5 + 0.04 * 0.5),
+    # Test distances > 1.
+    (1., [0, 3], [0.5, 0.5], 0.75),
+    # Test distances > 1.
+    (1., [-1, 3], [0.5, 0.5], 1),
+    # Test weight = 0.
+    (1., [0, 2], [1, 0], 1),
+    # Test 3 analogues, observation aligned.
+    (1., [0, 1, 2], [1./3, 1./3, 1./3], 2./9),
+    # Test 3 analogues, observation not aligned.
+    (1.5, [0, 1, 2], [1./3, 1./3, 1./3],
+     1./9 + 4./9 * 0.5 + 1./9 * 0.5),
+    # Test 3 analogues, observation below range.
+    (-1., [0, 1, 2], [1./3, 1./3, 1./3], 1 + 1./9 + 4./9),
+    # Test 3 analogues, observation above range.
+    (2.5, [0, 1, 2], [1./3, 1./3, 1./3], 4./9 + 1./9 + 0.5 * 1),
+    # Test 4 analogues, observation aligned.
+    (1., [0, 1, 2, 3], [0.25, 0.25, 0.25, 0.25], 3./8),
+    # Test 4 analogues, observation not aligned.
+    (1.5, [0, 1, 2, 3], [0.25, 0.25, 0.25, 0.25],
+     1./16 + 0.5 * 4./16 + 0.5 * 4./16 + 1./16),
+]
+
+NAN_EXAMPLES = [
+    (np.nan, 0),
+    (0, np.nan),
+    (0, [np.nan, np.nan]),
+    (0, [1], [np.nan]),
+    (0, [np.nan], [1]),
+    (np.nan, [1], [1]),
+]
 
 
 class TestDistributionBasedCRPS(unittest.TestCase):
 
-    def setUp(self):
+    @classmethod
+    def setUpClass(cls):
         np.random.seed(1983)
         shape = (2, 3)
-        self.mu = np.random.normal(size=shape)
-        self.sig = np.square(np.random.normal(size=shape))
-        self.obs = np.random.normal(loc=self.mu, scale=self.sig, size=shape)
+        cls.mu = np.random.normal(size=shape)
+        cls.sig = np.square(np.random.normal(size=shape))
+        cls.obs = np.random.normal(loc=cls.mu, scale=cls.sig, size=shape)
 
         n = 1000
         q = np.linspace(0. + 0.5 / n, 1. - 0.5 / n, n)
@@ -26,52 +87,46 @@ class TestDistributionBasedCRPS(unittest.TestCase):
         normppf = special.ndtri
         z = normppf(q)
 
-        forecasts = z.reshape(-1, 1, 1) * self.sig + self.mu
-        self.expected = crps_ensemble(self.obs, forecasts, axis=0)
-
-    def test_crps_quadrature_consistent(self):
+        forecasts = np.multiply(z.reshape(-1, 1, 1), cls.sig)
+        forecasts += cls.mu
+        cls.expected = crps_ensemble(cls.obs, forecasts, axis=0)
 
+        # crps_quadrature evaluates each cdf elementwise, so it needs an
+        # object array of callables rather than a single broadcasting cdf
         def normcdf(*args, **kwdargs):
             return stats.norm(*args, **kwdargs).cdf
-        dists = np.vectorize(normcdf)(loc=self.mu, scale=self.sig)
-        crps = crps_quadrature(self.obs, dists,
-                        xmin=self.mu - 5 * self.sig,
-                        xmax=self.mu + 5 * self.sig)
+        cls.cdfs = np.vectorize(normcdf)(loc=cls.mu, scale=cls.sig)
+        cls.xmin = cls.mu - 5 * cls.sig
+        cls.xmax = cls.mu + 5 * cls.sig
+
+        fcsts = np.linspace(-4., 4., 500)
+        cls.fcsts = (cls.mu[..., np.newaxis] + cls.sig[..., np.newaxis]
+                     * fcsts[np.newaxis, np.newaxis, :])
+        cls.pdf_weights = stats.norm.pdf(cls.fcsts,
+                                         loc=cls.mu[..., np.newaxis],
+                                         scale=cls.sig[..., np.newaxis])
+
+    def test_crps_quadrature_consistent(self):
+        crps = crps_quadrature(self.obs, self.cdfs,
+                               xmin=self.xmin, xmax=self.xmax)
         np.testing.assert_allclose(crps, self.expected, rtol=1e-4)
 
     def test_pdf_derived_weights(self):
         # One way of evaluating the CRPS given a pdf is to simply evaluate
         # the pdf at a set of points (fcsts) and set weights=pdf(fcsts).
         # This tests that that method works.
-        def normpdf(*args, **kwdargs):
-            return stats.norm(*args, **kwdargs).pdf
-        pdfs = np.vectorize(normpdf)(loc=self.mu, scale=self.sig)
-
-        fcsts = np.linspace(-4., 4., 500)
-        fcsts = (self.mu[..., np.newaxis] + self.sig[..., np.newaxis]
-                 * fcsts[np.newaxis, np.newaxis, :])
-
-        weights = np.empty_like(fcsts)
-        for i, j in np.ndindex(pdfs.shape):
-            weights[i, j] = pdfs[i, j](fcsts[i, j])
-
-        actual = crps_ensemble(self.obs, fcsts, weights)
+        actual = crps_ensemble(self.obs, self.fcsts, self.pdf_weights)
         np.testing.assert_allclose(actual, self.expected, rtol=1e-4)
 
     def test_crps_quadrature_fails(self):
-        def normcdf(*args, **kwdargs):
-            return stats.norm(*args, **kwdargs).cdf
-        cdfs = np.vectorize(normcdf)(loc=self.mu, scale=self.sig)
-        valid_call = functools.partial(crps_quadrature,
-                                       self.obs, cdfs,
-                                       xmin=self.mu - 5 * self.sig,
-                                       xmax=self.mu + 5 * self.sig)
         # this should fail because we have redefined the xmin/xmax
         # bounds to unreasonable values.  In order for the crps_quadrature
         # function to work it needs xmin/xmax values that bound the
         # range of the corresponding distribution.
-        self.assertRaises(ValueError, lambda: valid_call(xmin=self.mu))
-        self.assertRaises(ValueError, lambda: valid_call(xmax=self.mu))
+        with self.assertRaises(ValueError):
+            crps_quadrature(self.obs, self.cdfs, xmin=self.mu, xmax=self.xmax)
+        with self.assertRaises(ValueError):
+            crps_quadrature(self.obs, self.cdfs, xmin=self.xmin, xmax=self.mu)
 
     def test_crps_gaussian_consistent(self):
         actual = crps_gaussian(self.obs, self.mu, self.sig)
@@ -83,19 +138,30 @@ class TestDistributionBasedCRPS(unittest.TestCase):
         np.testing.assert_allclose(actual, expected)
 
     def test_grad(self):
-        from scipy import optimize
-        f = lambda z: crps_gaussian(self.obs[0, 0], z[0], z[1], grad=False)
-        g = lambda z: crps_gaussian(self.obs[0, 0], z[0], z[1], grad=True)[1]
-        x0 = np.array([self.mu.reshape(-1),
-                       self.sig.reshape(-1)]).T
-        for x in x0:
-            self.assertLessEqual(optimize.check_grad(f, g, x), 1e-6)
+        # compare the analytic gradient for every (mu, sig) pair against
+        # central finite differences, evaluated with broadcasting
+        obs, mu, sig = self.obs[0, 0], self.mu.ravel(), self.sig.ravel()
+        eps = 1e-6
+        _, grad = crps_gaussian(obs, mu, sig, grad=True)
+        approx = np.array([
+            (crps_gaussian(obs, mu + eps, sig)
+             - crps_gaussian(obs, mu - eps, sig)) / (2 * eps),
+            (crps_gaussian(obs, mu, sig + eps)
+             - crps_gaussian(obs, mu, sig - eps)) / (2 * eps)])
+        errors = np.sqrt(np.sum(np.square(grad - approx), axis=0))
+        self.assertLessEqual(errors.max(), 1e-6)
 
 
 class TestCRPS(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.n = 10
+        # the same members are set missing in each of the NaN tests
+        cls.missing = np.random.RandomState(123).rand(cls.n) > 0.5
+
     def setUp(self):
-        self.obs = np.random.randn(10)
-        self.forecasts = np.random.randn(10, 5)
+        self.obs = np.random.randn(self.n)
+        self.forecasts = np.random.randn(self.n, 5)
 
     def test_validation(self):
         failures = [([0, 1], 0),
@@ -106,39 +172,28 @@ class TestCRPS(unittest.TestCase):
                 crps_ensemble(*failure)
 
     def test_basic_consistency(self):
-        expected = np.array([crps_ensemble(o, f) for o, f
-                             in zip(self.obs, self.forecasts)])
+        expected = _crps_ensemble_vectorized(self.obs, self.forecasts)
         assert_allclose(
             crps_ensemble(self.obs, self.forecasts),
             expected)
         assert_allclose(
             crps_ensemble(self.obs, self.forecasts.T, axis=0),
             expected)
-        assert_allclose(crps_ensemble(self.obs, self.obs), np.zeros(10))
-
-    def test_crps_toy_examples(self):
-        examples = [
-            (0, 0, 0.0),
-            (0, 1, 1.0),
-            (-1, 0, 1.0),
-            (0, [-1], 1.0),
-            (0, [0], 0.0),
-            (0, [1], 1.0),
-            (0, [0, 0], 0.0),
-            (0, [0, 1], 0.25),
-            (0, [1, 0], 0.25),
-            (0, [1, 1], 1.0),
-            (2, [0, 1], 1.25),
-            (0, [-1, 1], 0.5),
-            (0, [0, 0, 1], 1.0 / 9),
-            (1, [0, 0, 1], 4.0 / 9),
-            (0, [-1, 0, 0, 1], 1.0 / 8),
-        ]
-        for x, ensemble, expected in examples:
-            self.assertAlmostEqual(
-                crps_ensemble(x, ensemble), expected)
-            self.assertAlmostEqual(
-                _crps_ensemble_vectorized(x, ensemble), expected)
+        assert_allclose(crps_ensemble(self.obs, self.obs), np.zeros(self.n))
+
+    def test_padded_examples(self):
+        # ensembles of different sizes can be scored together by padding
+        # them with NaN, which is skipped
+        examples = TOY_EXAMPLES[-4:]
+        size = max(len(ensemble) for _, ensemble, _ in examples)
+        obs = np.array([x for x, _, _ in examples], dtype=float)
+        forecasts = np.full((len(examples), size), np.nan)
+        for i, (_, ensemble, _) in enumerate(examples):
+            forecasts[i, :len(ensemble)] = ensemble
+        expected = np.array([e for _, _, e in examples])
+        assert_allclose(crps_ensemble(obs, forecasts), expected, atol=1e-7)
+        assert_allclose(_crps_ensemble_vectorized(obs, forecasts), expected,
+                        atol=1e-7)
 
     def test_high_dimensional_consistency(self):
         obs = np.random.randn(10, 20)
@@ -156,6 +211,12 @@ class TestCRPS(unittest.TestCase):
         self.assertEqual(
             crps_ensemble(x, vec_sorted, issorted=False),
             crps_ensemble(x, vec_sorted, issorted=True))
+        # weights must be sorted along with the ensemble
+        weights = np.random.random((10,))
+        idx = argsort_indices(vec)
+        self.assertEqual(
+            crps_ensemble(x, vec, weights),
+            crps_ensemble(x, vec[idx], weights[idx], issorted=True))
 
     def test_weight_normalization(self):
         x = np.random.random()
@@ -168,53 +229,22 @@ class TestCRPS(unittest.TestCase):
             # mismatched dimensions
             crps_ensemble(x, vec, np.ones(5))
 
-    def test_crps_weight_examples(self):
-        examples = [
-            # Simplest test.
-            (1., [0, 2], [0.5, 0.5], 0.5),
-            # Out-of-order analogues.
-            (1., [2, 0], [0.5, 0.5], 0.5),
-            # Test non-equal weighting.
-            (1., [0, 2], [0.8, 0.2], 0.64 + 0.04),
-            # Test non-equal weighting + non-equal distances.
-            (1.5, [0, 2], [0.8, 0.2], 0.64 * 1.5 + 0.04 * 0.5),
-            # Test distances > 1.
-            (1., [0, 3], [0.5, 0.5], 0.75),
-            # Test distances > 1.
-            (1., [-1, 3], [0.5, 0.5], 1),
-            # Test weight = 0.
-            (1., [0, 2], [1, 0], 1),
-            # Test 3 analogues, observation aligned.
-            (1., [0, 1, 2], [1./3, 1./3, 1./3], 2./9),
-            # Test 3 analogues, observation not aligned.
-            (1.5, [0, 1, 2], [1./3, 1./3, 1./3],
-             1./9 + 4./9 * 0.5 + 1./9 * 0.5),
-            # Test 3 analogues, observation below range.
-             (-1., [0, 1, 2], [1./3, 1./3, 1./3],  1 + 1./9 + 4./9),
-            # Test 3 analogues, observation above range.
-            (2.5, [0, 1, 2], [1./3, 1./3, 1./3], 4./9 + 1./9 + 0.5 * 1),
-            # Test 4 analogues, observation aligned.
-            (1., [0, 1, 2, 3], [0.25, 0.25, 0.25, 0.25], 3./8),
-            # Test 4 analogues, observation not aligned.
-            (1.5, [0, 1, 2, 3], [0.25, 0.25, 0.25, 0.25],
-             1./16 + 0.5 * 4./16 + 0.5 * 4./16 + 1./16),
-        ]
-        for x, ensemble, weights, expected in examples:
-            self.assertAlmostEqual(
-                crps_ensemble(x, ensemble, weights), expected)
-
-    def test_crps_toy_examples_nan(self):
-        examples = [
-            (np.nan, 0),
-            (0, np.nan),
-            (0, [np.nan, np.nan]),
-            (0, [1], [np.nan]),
-            (0, [np.nan], [1]),
-            (np.nan, [1], [1]),
-        ]
-        for args in examples:
-            self.assertTrue(
-                np.isnan(crps_ensemble(*args)))
+    def test_large_offset_precision(self):
+        # CRPS is invariant to shifting observations and forecasts together;
+        # use dyadic values so that the shifted inputs are exact
+        offset = 2.0 ** 30
+        obs = np.round(self.obs * 1024) / 1024
+        forecasts = np.round(self.forecasts * 1024) / 1024
+        weights = np.random.rand(*forecasts.shape)
+        expected = _crps_ensemble_vectorized(obs, forecasts, weights)
+        actual = _crps_ensemble_vectorized(obs + offset, forecasts + offset,
+                                           weights)
+        assert_allclose(actual, expected, rtol=1e-12)
+
+    def test_crps_empty_ensemble(self):
+        self.assertTrue(np.isnan(_crps_ensemble_vectorized(0, [])))
+        self.assertTrue(np.isnan(
+            _crps_ensemble_vectorized(np.zeros(2), np.empty((2, 0)))).all())
 
     def test_crps_toy_examples_skipna(self):
         self.assertEqual(crps_ensemble(0, [np.nan, 1]), 1)
@@ -223,16 +253,14 @@ class TestCRPS(unittest.TestCase):
         self.assertEqual(crps_ensemble(1, [0, np.nan]), 1)
 
     def test_nan_observations_consistency(self):
-        rs = np.random.RandomState(123)
-        self.obs[rs.rand(*self.obs.shape) > 0.5] = np.nan
+        self.obs[self.missing] = np.nan
         assert_allclose(
             crps_ensemble(self.obs, self.forecasts),
             _crps_ensemble_vectorized(self.obs, self.forecasts))
 
     def test_nan_forecasts_consistency(self):
-        rs = np.random.RandomState(123)
         # make some forecasts entirely missing
-        self.forecasts[rs.rand(*self.obs.shape) > 0.5] = np.nan
+        self.forecasts[self.missing] = np.nan
         assert_allclose(
             crps_ensemble(self.obs, self.forecasts),
             _crps_ensemble_vectorized(self.obs, self.forecasts))
@@ -284,3 +312,23 @@ class TestCRPS(unittest.TestCase):
 
         using_vectorized = _crps_ensemble_core is _crps_ensemble_vectorized
         self.assertEqual(using_vectorized, not has_numba)
+
+
+# The example tables are parametrized row by row, so that each row is
+# reported (and can be distributed by pytest-xdist) independently.
+
+@pytest.mark.parametrize('x, ensemble, expected', TOY_EXAMPLES)
+def test_crps_toy_example(x, ensemble, expected):
+    assert_allclose(crps_ensemble(x, ensemble), expected, atol=1e-7)
+    assert_allclose(_crps_ensemble_vectorized(x, ensemble), expected,
+                    atol=1e-7)
+
+
+@pytest.mark.parametrize('x, ensemble, weights, expected', WEIGHT_EXAMPLES)
+def test_crps_weight_example(x, ensemble, weights, expected):
+    assert_allclose(crps_ensemble(x, ensemble, weights), expected, atol=1e-7)
+
+
+@pytest.mark.parametrize('args', NAN_EXAMPLES)
+def test_crps_toy_example_nan(args):
+    assert np.isnan(crps_ensemble(*args))
@@ -1,7 +1,7 @@
 import unittest
 
 import numpy as np
-from numpy.testing import assert_allclose
+from numpy.testing import assert_array_equal
 
 from properscoring._utils import argsort_indices, move_axis_to_end
 
@@ -12,7 +12,7 @@ class TestArgsortIndices(unittest.TestCase):
         for axis in [0, 1, 2, -1]:
             expected = np.sort(x, axis=axis)
             idx = argsort_indices(x, axis=axis)
-            assert_allclose(expected, x[idx])
+            assert_array_equal(expected, x[idx])
 
 
 class TestMoveAxis(unittest.TestCase):
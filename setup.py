@@ -29,5 +29,5 @@ setup(name='properscoring',
       author_email='eng@climate.com',
       url='https://github.com/TheClimateCorporation/properscoring',
       install_requires=['numpy', 'scipy'],
-      tests_require=['nose'],
+      tests_require=['pytest'],
       packages=find_packages())